@@ -1,15 +1,629 @@
 """Main application and routing logic for Spotify Song Suggester."""
 import base64
-from flask_sqlalchemy import SQLAlchemy
-from flask import Flask, request
+from concurrent.futures import ThreadPoolExecutor
+from flask import abort, Flask, request, Response
+from flask.json import JSONEncoder
+from functools import lru_cache
 import io
-import json
-import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from models import (
+    DB, FEATURE_ATTRS, NUM_FEATURES, RESULT_FIELDS, Track, TrackDTO
+)
 import numpy as np
+import orjson
+import os
 from os import getenv
-import pandas as pd
-import pickle
-from spotipy import oauth2, Spotify
+import queue
+import random
+import requests
+from requests.adapters import HTTPAdapter
+from sklearn.neighbors import KDTree
+from spotipy import oauth2, Spotify, SpotifyException
+from sqlalchemy import select
+import threading
+import time
+
+try:
+    import faiss
+except ImportError:  # faiss is only needed for the optional HNSW index
+    faiss = None
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba is only needed to compile the brute-force kernel
+    njit = None
+    prange = range
+
+# Seconds before the access token expires at which it is refreshed
+TOKEN_EXPIRY_BUFFER = 30
+
+# Maximum number of Spotify searches in flight at once for a single request
+SEARCH_MAX_WORKERS = 2
+
+# Client-side limits on calls to the Spotify API across all requests, how
+# many times a rate limited (429) or server error (5xx) call is retried, and
+# the longest wait in seconds before a retry, past which the request fails
+# with a 503 instead
+SPOTIFY_RATE_LIMIT = 10
+SPOTIFY_MAX_CONCURRENT = 2
+SPOTIFY_MAX_RETRIES = 3
+SPOTIFY_MAX_RETRY_WAIT = 30
+
+# Number of responses per route kept in the in-process track ID caches
+CACHE_SIZE = 4096
+
+# Number of rendered /visualize charts kept in the in-process cache
+CHART_CACHE_SIZE = 256
+
+# Most suggestions returned by /get-suggestions, which bounds the size of
+# each cached response
+MAX_SUGGESTIONS = 100
+
+# Largest magnitude of the 8-bit codes of the quantized brute-force matrix
+INT8_MAX_CODE = 127
+
+# HNSW graph degree and search breadth for the optional faiss index
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# Prebuilt faiss HNSW index files by NEIGHBOR_INDEX setting, written next to
+# rm_05.npy by src/build_index.py so workers load rather than build them
+HNSW_INDEX_PATHS = {
+    'hnsw': './hnsw_05.index',
+    'hnsw-sq8': './hnsw_sq8_05.index'
+}
+
+# Numeric track columns that can be filtered on by /match-feature
+MATCH_FEATURES = [
+    'acousticness',
+    'danceability',
+    'duration_ms',
+    'energy',
+    'instrumentalness',
+    'key',
+    'liveness',
+    'loudness',
+    'mode',
+    'popularity',
+    'speechiness',
+    'tempo',
+    'time_signature',
+    'valence'
+]
+
+# Number of pre-built radar chart figures shared by /visualize requests
+FIGURE_POOL_SIZE = 4
+
+# Audio features plotted on the /visualize radar chart
+RADAR_FEATURES = [
+    'acousticness',
+    'danceability',
+    'energy',
+    'instrumentalness',
+    'liveness',
+    'valence'
+]
+
+# Radar chart vertex angles, ending back at the start to close the polygon
+RADAR_ANGLES = np.linspace(0, 2 * np.pi, len(RADAR_FEATURES) + 1)
+
+# Number of float32 values in each thread's per-request vector arena
+ARENA_SIZE = 1024
+
+
+class RateLimiter:
+    """A token bucket limiting the rate and concurrency of API calls
+
+    Used as a context manager around each call, blocking until the call is
+    allowed to start.
+
+    Attributes
+    ----------
+    rate : float
+        the number of calls allowed to start per second
+    tokens : float
+        the number of calls that can currently start without waiting
+    updated : float
+        the monotonic time the tokens were last refilled
+    lock : Lock
+        a lock guarding the token count
+    slots : BoundedSemaphore
+        a semaphore limiting the number of calls in flight
+
+    Methods
+    -------
+    __enter__()
+        Wait for a free slot and token before a call
+
+    __exit__()
+        Release the slot after a call
+
+    """
+
+    def __init__(self, rate, max_concurrent):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+
+    def __enter__(self):
+        self.slots.acquire()
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.updated
+            self.tokens = min(self.rate, self.tokens + elapsed * self.rate)
+            self.updated = now
+            # A negative balance reserves a future token for this call
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.slots.release()
+
+
+class VectorArena:
+    """A bump allocator handing out small float32 arrays from one buffer
+
+    Each request thread allocates its query vectors as views of its arena
+    instead of new arrays, and the arena is reset when the request ends, so
+    the views must not outlive the request.
+
+    Attributes
+    ----------
+    buf : array
+        the float32 buffer the arrays are views of
+    off : int
+        the offset of the first free value in the buffer
+
+    Methods
+    -------
+    alloc()
+        Get an uninitialized array from the free part of the buffer
+
+    reset()
+        Free every array allocated since the last reset
+
+    """
+
+    def __init__(self, size):
+        self.buf = np.empty(size, dtype=np.float32)
+        self.off = 0
+
+    def alloc(self, shape):
+        """Gets an uninitialized float32 array from the arena
+
+        Falls back to a new array once the arena is full.
+
+        Parameters
+        ----------
+        shape : tuple
+            The shape of the array
+
+        Returns
+        -------
+        array
+            a C-contiguous array of the given shape
+        """
+
+        size = int(np.prod(shape))
+        if self.off + size > len(self.buf):
+            return np.empty(shape, dtype=np.float32)
+        out = self.buf[self.off:self.off + size].reshape(shape)
+        self.off += size
+        return out
+
+    def reset(self):
+        """Frees every array allocated from the arena"""
+
+        self.off = 0
+
+
+class SingleAttemptSpotify(Spotify):
+    """A Spotify client that sends each GET request only once
+
+    The spotipy client retries rate limited and failed GET requests itself,
+    and returns None once it runs out of retries. Those retries bypass the
+    RateLimiter, so here a failed request raises its SpotifyException
+    straight away and call_spotify handles the retries. An empty response
+    raises too, rather than reaching the client methods as None.
+
+    Methods
+    -------
+    _get()
+        Send a GET request to the Spotify API without retrying
+
+    """
+
+    def _get(self, url, args=None, payload=None, **kwargs):
+        if args:
+            kwargs.update(args)
+        results = self._internal_call('GET', url, payload, kwargs)
+        if results is None:
+            raise SpotifyException(
+                502, -1, 'Empty response from the Spotify API'
+            )
+        return results
+
+
+class TrackJSONEncoder(JSONEncoder):
+    """A Flask JSON encoder that can serialize tracks
+
+    Track and TrackDTO objects are encoded as their display information, so
+    they can be passed to jsonify directly.
+
+    Methods
+    -------
+    default()
+        Convert a track to its display information, or defer to Flask
+
+    """
+
+    def default(self, o):
+        if isinstance(o, (Track, TrackDTO)):
+            return o.result_dict()
+        return super().default(o)
+
+
+def load_features(path):
+    """Load the scaled track features the neighbor index is built from
+
+    The array is memory-mapped copy-on-write rather than read into memory, so
+    forked app workers share the same pages of the OS page cache.
+
+    Parameters
+    ----------
+    path : str
+        The path to the .npy file of the (N, 12) scaled audio features, where
+        row i holds the track with database ID i
+
+    Returns
+    -------
+    array
+        the memory-mapped array of scaled audio features
+    """
+
+    # Ask the OS to start reading the file in before the index is built
+    if hasattr(os, 'posix_fadvise'):
+        with open(path, 'rb') as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+    return np.load(path, mmap_mode='c')
+
+
+def build_hnsw_index(data, quantize=False):
+    """Build a faiss HNSW index over the scaled track features
+
+    Parameters
+    ----------
+    data : array
+        The (N, 12) array of scaled audio features, where row i holds the
+        track with database ID i
+    quantize : bool, optional
+        Whether to store the vectors as 8-bit codes, with the range of each
+        feature learned from the data, instead of float32
+
+    Returns
+    -------
+    faiss.IndexHNSW
+        the index, whose search results are database IDs
+
+    Raises
+    ------
+    ImportError:
+        an exception if faiss is not installed
+    """
+
+    if faiss is None:
+        raise ImportError('faiss is required for the HNSW neighbor index')
+
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    if quantize:
+        index = faiss.IndexHNSWSQ(
+            data.shape[1], faiss.ScalarQuantizer.QT_8bit, HNSW_M
+        )
+        index.train(data)
+    else:
+        index = faiss.IndexHNSWFlat(data.shape[1], HNSW_M)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    index.add(data)
+    return index
+
+
+def load_hnsw_index(path, data):
+    """Load a prebuilt faiss HNSW index over the scaled track features
+
+    Building the graph takes tens of seconds for the full dataset, so the
+    index is built once by src/build_index.py and only read at startup.
+
+    Parameters
+    ----------
+    path : str
+        The path to the index file written by src/build_index.py
+    data : array
+        The (N, 12) array of scaled audio features the index was built from
+
+    Returns
+    -------
+    faiss.IndexHNSW
+        the index, whose search results are database IDs
+
+    Raises
+    ------
+    ImportError:
+        an exception if faiss is not installed
+    FileNotFoundError:
+        an exception if the index file hasn't been built
+    ValueError:
+        an exception if the index doesn't hold one vector per row of data
+    """
+
+    if faiss is None:
+        raise ImportError('faiss is required for the HNSW neighbor index')
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f'{path} not found, build it with src/build_index.py'
+        )
+
+    index = faiss.read_index(path)
+    if index.ntotal != len(data):
+        raise ValueError(
+            f'{path} holds {index.ntotal} tracks but the features hold '
+            f'{len(data)}, rebuild it with src/build_index.py'
+        )
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+
+def squared_distances(matrix, query):
+    """Compute the squared Euclidean distance from a query to every track
+
+    Parameters
+    ----------
+    matrix : array
+        The C-contiguous (N, 12) float32 array of scaled audio features
+    query : array
+        The (12,) float32 array of scaled audio features to compare against
+
+    Returns
+    -------
+    array
+        the (N,) float32 array of squared distances, one per row of matrix
+    """
+
+    dists = np.empty(matrix.shape[0], dtype=np.float32)
+    for i in prange(matrix.shape[0]):
+        s = np.float32(0.0)
+        for j in range(matrix.shape[1]):
+            d = matrix[i, j] - query[j]
+            s += d * d
+        dists[i] = s
+    return dists
+
+
+def squared_distances_int8(matrix, query):
+    """Compute the squared distance from a quantized query to every track
+
+    Parameters
+    ----------
+    matrix : array
+        The C-contiguous (N, 12) int8 array of quantized audio features
+    query : array
+        The (12,) int8 array of quantized audio features to compare against
+
+    Returns
+    -------
+    array
+        the (N,) int32 array of squared distances between the codes, one per
+        row of matrix
+    """
+
+    dists = np.empty(matrix.shape[0], dtype=np.int32)
+    for i in prange(matrix.shape[0]):
+        s = np.int32(0)
+        for j in range(matrix.shape[1]):
+            d = np.int32(matrix[i, j]) - np.int32(query[j])
+            s += d * d
+        dists[i] = s
+    return dists
+
+
+def squared_distances_numpy(matrix, query):
+    """Compute the squared Euclidean distance from a query to every track
+
+    Used as squared_distances() when numba isn't installed, since the Python
+    loops are far too slow to run uncompiled.
+
+    Parameters
+    ----------
+    matrix : array
+        The (N, 12) float32 array of scaled audio features
+    query : array
+        The (12,) float32 array of scaled audio features to compare against
+
+    Returns
+    -------
+    array
+        the (N,) float32 array of squared distances, one per row of matrix
+    """
+
+    diff = matrix - query
+    return np.einsum('ij,ij->i', diff, diff)
+
+
+def squared_distances_int8_numpy(matrix, query):
+    """Compute the squared distance from a quantized query to every track
+
+    Used as squared_distances_int8() when numba isn't installed. The codes
+    are widened to int16 before subtracting so the differences can't
+    overflow, and summed as int32 like the compiled version.
+
+    Parameters
+    ----------
+    matrix : array
+        The (N, 12) int8 array of quantized audio features
+    query : array
+        The (12,) int8 array of quantized audio features to compare against
+
+    Returns
+    -------
+    array
+        the (N,) int32 array of squared distances between the codes, one per
+        row of matrix
+    """
+
+    diff = matrix.astype(np.int16) - query
+    return np.einsum('ij,ij->i', diff, diff, dtype=np.int32)
+
+
+# Compiled for the one signature each is called with, so the first request
+# doesn't wait on the JIT. Without numba the array operation versions above
+# are used instead of the Python loops.
+if njit is not None:
+    squared_distances = njit(
+        'float32[::1](float32[:, ::1], float32[::1])',
+        parallel=True, fastmath=True, cache=True
+    )(squared_distances)
+    squared_distances_int8 = njit(
+        'int32[::1](int8[:, ::1], int8[::1])',
+        parallel=True, fastmath=True, cache=True
+    )(squared_distances_int8)
+else:
+    squared_distances = squared_distances_numpy
+    squared_distances_int8 = squared_distances_int8_numpy
+
+
+def quantize_features(data):
+    """Quantize the scaled track features to 8-bit codes
+
+    Each feature is shifted by its own offset, but all features share one
+    scale, so distances between codes stay proportional to distances between
+    the features they encode.
+
+    Parameters
+    ----------
+    data : array
+        The (N, 12) array of scaled audio features
+
+    Returns
+    -------
+    tuple
+        the C-contiguous (N, 12) int8 array of codes, and the (12,) offset
+        and scalar scale that quantize_query() encodes queries with
+    """
+
+    low = data.min(axis=0)
+    high = data.max(axis=0)
+    offset = (low + high) / 2
+    scale = INT8_MAX_CODE / max((high - low).max() / 2, np.finfo(float).eps)
+    codes = np.ascontiguousarray(quantize_query(data, offset, scale))
+    return codes, offset, scale
+
+
+def quantize_query(query, offset, scale):
+    """Encode scaled audio features as 8-bit codes
+
+    Parameters
+    ----------
+    query : array
+        The scaled audio features to encode
+    offset : array
+        The (12,) per-feature offset from quantize_features()
+    scale : float
+        The scale from quantize_features()
+
+    Returns
+    -------
+    array
+        the int8 codes of the features, clipped to the range of the codes
+    """
+
+    codes = np.rint((query - offset) * scale)
+    np.clip(codes, -INT8_MAX_CODE, INT8_MAX_CODE, out=codes)
+    return codes.astype(np.int8)
+
+
+def knn_topk(matrix, query, k):
+    """Find the nearest tracks to a query by brute force
+
+    Parameters
+    ----------
+    matrix : array
+        The C-contiguous (N, 12) float32 array of scaled audio features, or
+        int8 array of their codes, where row i holds the track with database
+        ID i
+    query : array
+        The (12,) array of scaled audio features or codes to search for, of
+        the same dtype as matrix
+    k : int
+        The number of neighbors to return
+
+    Returns
+    -------
+    array
+        the database IDs of the nearest tracks, nearest first, which is empty
+        if k is less than 1
+
+    Raises
+    ------
+    TypeError:
+        an exception if the query and matrix dtypes differ, which would
+        otherwise upcast the whole scan
+    """
+
+    if query.dtype != matrix.dtype:
+        raise TypeError(
+            f'query dtype {query.dtype} does not match {matrix.dtype}'
+        )
+    if matrix.dtype == np.int8:
+        dists = squared_distances_int8(matrix, query)
+    else:
+        dists = squared_distances(matrix, query)
+    k = min(k, len(dists))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    top = np.argpartition(dists, k - 1)[:k]
+    return top[np.argsort(dists[top], kind='stable')]
+
+
+def build_radar_figure():
+    """Build an empty radar chart figure for the /visualize features
+
+    The axes, grid, and feature labels are the same for every chart, so they
+    are set up once here and only the polygons are drawn per request.
+
+    Returns
+    -------
+    tuple
+        the matplotlib Figure and its polar Axes
+    """
+
+    fig = Figure(figsize=(6, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111, polar=True)
+    ax.set_theta_offset(np.pi / 2)
+    ax.set_theta_direction(-1)
+    ax.set_thetagrids(np.degrees(RADAR_ANGLES[:-1]), RADAR_FEATURES)
+    ax.set_rlabel_position(0)
+    ax.set_yticks([0.20, 0.40, 0.60, 0.80])
+    ax.set_yticklabels(['0.20', '0.40', '0.60', '0.80'])
+    ax.set_ylim(0, 1)
+
+    # Set feature labels so they don't overlap the chart
+    for label, angle in zip(ax.get_xticklabels(), RADAR_ANGLES):
+        if angle in [0, np.pi]:
+            label.set_horizontalalignment('center')
+        elif 0 < angle < np.pi:
+            label.set_horizontalalignment('left')
+        else:
+            label.set_horizontalalignment('right')
+
+    return fig, ax
 
 
 def create_app():
@@ -23,14 +637,30 @@ def create_app():
     """
     app = Flask(__name__)
 
+    # Let jsonify serialize tracks
+    app.json_encoder = TrackJSONEncoder
+
     # Add config for database
     app.config['SQLALCHEMY_DATABASE_URI'] = getenv('DATABASE_URL')
 
     # Stop tracking modifications on SQLAlchemy config
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-    DB = SQLAlchemy(app)
-    DB.Model.metadata.reflect(DB.engine)
+    # Keep enough pooled Postgres connections open for the worker threads,
+    # recycling them before the server drops idle connections
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': 20,
+        'max_overflow': 10,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True
+    }
+
+    # Reflect only the track table and map the Track model. This runs once
+    # per process, as later calls to prepare are no-ops that do not query
+    # the database.
+    DB.init_app(app)
+    engine = DB.get_engine(app)
+    Track.prepare(engine)
 
     # Spotify API authentication
     cid = getenv('SPOTIFY_CLIENT_ID')
@@ -41,9 +671,69 @@ def create_app():
         client_secret=secret
     )
 
-    # KDTree model and data scaler loaded from pickle
-    model = pickle.load(open('./rm_05.pkl', 'rb'))
-    scaler = pickle.load(open('./sc_05.pkl', 'rb'))
+    # Single Spotify client sharing one pooled HTTP session across requests
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(
+        pool_connections=1, pool_maxsize=SPOTIFY_MAX_CONCURRENT
+    ))
+    spotify = SingleAttemptSpotify(requests_session=session)
+    spotify_limiter = RateLimiter(SPOTIFY_RATE_LIMIT, SPOTIFY_MAX_CONCURRENT)
+    token_lock = threading.Lock()
+    token_expiry = 0.0
+    search_executor = ThreadPoolExecutor(max_workers=SEARCH_MAX_WORKERS)
+
+    # KDTree model built over the memory-mapped scaled features, and the
+    # fitted MinMaxScaler parameters used to scale query features, cast once
+    # to the float32 the query vectors are built in
+    features = load_features('./rm_05.npy')
+    model = KDTree(features)
+    with np.load('./sc_05.npz') as scaler:
+        scaler_scale = scaler['scale'].astype(np.float32)
+        scaler_min = scaler['min'].astype(np.float32)
+
+    # Database IDs and features of every track, cached in process. The
+    # database ID of a track is also its row in the scaled feature array.
+    with engine.connect() as conn:
+        Track.load_feature_cache(conn)
+
+    # Neighbor index to query, either the KDTree, an HNSW graph over the
+    # same data (set NEIGHBOR_INDEX=hnsw, or hnsw-sq8 for 8-bit quantized
+    # vectors, loaded from the files prebuilt by src/build_index.py,
+    # requires faiss), or an exact brute-force scan of a
+    # float32 copy of the data (set NEIGHBOR_INDEX=brute, or brute-int8 for
+    # 8-bit quantized vectors, compiled with numba if installed)
+    hnsw_index = None
+    brute_features = None
+    brute_quantizer = None
+    seed_rows = features
+    neighbor_index = getenv('NEIGHBOR_INDEX', 'kdtree')
+    if neighbor_index in HNSW_INDEX_PATHS:
+        hnsw_index = load_hnsw_index(
+            HNSW_INDEX_PATHS[neighbor_index], features
+        )
+    elif neighbor_index == 'brute':
+        brute_features = np.ascontiguousarray(features, dtype=np.float32)
+        # Take indexed seeds from the float32 copy so queries aren't cast
+        seed_rows = brute_features
+    elif neighbor_index == 'brute-int8':
+        brute_features, *brute_quantizer = quantize_features(features)
+
+    # Radar chart figures are built once and reused, as setting up the polar
+    # axes costs more than drawing the polygons
+    figure_pool = queue.Queue()
+    for _ in range(FIGURE_POOL_SIZE):
+        figure_pool.put(build_radar_figure())
+
+    # Per-thread arena the query vectors of a request are allocated from
+    query_local = threading.local()
+
+    @app.teardown_request
+    def reset_arena(exc):
+        """Frees the query vectors allocated during the request"""
+
+        arena = getattr(query_local, 'arena', None)
+        if arena is not None:
+            arena.reset()
 
     @app.route('/')
     def root():
@@ -70,13 +760,12 @@ def create_app():
             a json of the track info to send to the back-end
         """
 
-        token = credentials.get_access_token()
-        spotify = Spotify(auth=token)
         track_id = request.args.get(
             'track_id', default='06w9JimcZu16KyO3WXR459', type=str
         )
-        results = spotify.track(track_id)
-        return parse_track_info(results)
+        return Response(
+            fetch_track_info(track_id), mimetype='application/json'
+        )
 
     @app.route('/audio-features')
     def audio_features():
@@ -92,21 +781,20 @@ def create_app():
             the back-end
         """
 
-        token = credentials.get_access_token()
-        spotify = Spotify(auth=token)
         track_id = request.args.get(
             'track_id', default='06w9JimcZu16KyO3WXR459', type=str
         )
-        results = spotify.audio_features(track_id)
-        return json.dumps(results)
+        return Response(
+            fetch_audio_features(track_id), mimetype='application/json'
+        )
 
     @app.route('/get-suggestions')
     def get_suggestions():
         """Get the model suggestions for similar tracks for a Spotify track
 
         This function takes a request with a seed track ID and the number of
-        tracks to return. Returns a JSON object with track information for the
-        seed and resulting suggested tracks
+        tracks to return, from 0 up to MAX_SUGGESTIONS. Returns a JSON object
+        with track information for the seed and resulting suggested tracks
 
         Returns
         -------
@@ -121,15 +809,11 @@ def create_app():
         num_tracks = request.args.get(
             'num', default=10, type=int
         )
-        query1 = Track.query.filter(Track.track_id == seed_track).first()
-        _, results = model.query(
-            scaler.transform([query1.to_array()]), k=num_tracks+1
+        num_tracks = min(max(num_tracks, 0), MAX_SUGGESTIONS)
+        return Response(
+            find_suggestions(seed_track, num_tracks),
+            mimetype='application/json'
         )
-        suggested_tracks = [id.item() for id in results[0]]
-        stmt = Track.query.filter(Track.id.in_(suggested_tracks))
-        query2 = stmt.filter(Track.track_id != seed_track).all()
-
-        return f'{{"seed": {query1}, "results": {query2}}}'
 
     @app.route('/search')
     def search():
@@ -142,6 +826,10 @@ def create_app():
 
             artist name, track name, track ID, album art
 
+        The track name may be given more than once, in which case the
+        searches are sent to Spotify concurrently and their results are
+        returned together in the order the names were given.
+
         Returns
         -------
         json
@@ -149,24 +837,28 @@ def create_app():
         """
 
         default_track = 'Perfect Nelson Remix'
-        track_name = request.args.get(
-            'track_name', default=default_track, type=str
-        )
+        track_names = request.args.getlist('track_name') or [default_track]
         limit = request.args.get(
             'limit', default=6, type=int
         )
         page = request.args.get(
             'page', default=1, type=int
         )
-        token = credentials.get_access_token()
-        spotify = Spotify(auth=token)
-        results = spotify.search(
-            q=f'track:{track_name}',
-            type='track',
-            limit=limit,
-            offset=limit*(page-1)
-        )
-        return get_search_info(results)
+
+        def search_track(track_name):
+            return call_spotify(
+                'search',
+                q=f'track:{track_name}',
+                type='track',
+                limit=limit,
+                offset=limit*(page-1)
+            )
+
+        if len(track_names) == 1:
+            results = [search_track(track_names[0])]
+        else:
+            results = list(search_executor.map(search_track, track_names))
+        return Response(get_search_info(results), mimetype='application/json')
 
     @app.route('/match-feature')
     def match_feature():
@@ -177,9 +869,9 @@ def create_app():
 
         Returns
         -------
-        str
-            a string representing the database query results for tracks that
-            match the specified range of the target feature
+        json
+            a json of the track information for tracks that match the
+            specified range of the target feature
         """
 
         feature = request.args.get(
@@ -195,18 +887,43 @@ def create_app():
             'limit', default=20, type=int
         )
 
+        column = feature_columns.get(feature)
+        if column is None:
+            abort(400)
+
         output = {}
-        condition1 = f'(Track.{feature} >= min_)'
-        condition2 = f'(Track.{feature} <= max_)'
-        if min_ and max_:
-            condition = f'({condition1} & {condition2})'
-            output = Track.query.filter(eval(condition)).limit(lim).all()
-        elif min_:
-            output = Track.query.filter(eval(condition1)).limit(lim).all()
-        elif max_:
-            output = Track.query.filter(eval(condition2)).limit(lim).all()
-
-        return str(output)
+        values = None
+        if feature in FEATURE_ATTRS:
+            values = Track.feature_column(feature)
+        if (min_ is not None or max_ is not None) and values is not None:
+            # Model features are filtered in memory over the contiguous
+            # cached column, so only the matching tracks are queried
+            matches = np.ones(len(values), dtype=bool)
+            if min_ is not None:
+                matches &= values >= min_
+            if max_ is not None:
+                matches &= values <= max_
+            rows = np.flatnonzero(matches)[:max(lim, 0)]
+            ids = Track.feature_ids()[rows].tolist()
+            table = Track.__table__
+            query = select([table.c.id] + result_columns)
+            by_id = {
+                row[0]: dict(zip(RESULT_FIELDS, row[1:]))
+                for row in DB.session.execute(
+                    query.where(table.c.id.in_(ids))
+                )
+            }
+            output = [by_id[id] for id in ids if id in by_id]
+        elif min_ is not None or max_ is not None:
+            query = select(result_columns)
+            if min_ is not None:
+                query = query.where(column >= min_)
+            if max_ is not None:
+                query = query.where(column <= max_)
+            rows = DB.session.execute(query.limit(lim)).fetchall()
+            output = [dict(zip(RESULT_FIELDS, row)) for row in rows]
+
+        return Response(orjson.dumps(output), mimetype='application/json')
 
     @app.route('/visualize')
     def visualize():
@@ -228,7 +945,6 @@ def create_app():
         png
             a png image file of the radar chart for the given IDs and labels
         """
-        plt.switch_backend('Agg')  # avoid error from matplotlib
 
         id_a = request.args.get(
             'id_a', default='06w9JimcZu16KyO3WXR459', type=str
@@ -243,88 +959,431 @@ def create_app():
             'label_b', default=id_b, type=str
         )
 
-        track_a = Track.query.filter(Track.track_id == id_a).first()
-        track_b = Track.query.filter(Track.track_id == id_b).first()
+        return render_radar_chart(id_a, id_b, label_a, label_b)
 
-        track_df = pd.DataFrame(
-            [
-                track_a.to_dict(),
-                track_b.to_dict()
-            ]
-        )
+    @lru_cache(maxsize=CHART_CACHE_SIZE)
+    def render_radar_chart(id_a, id_b, label_a, label_b):
+        """A helper function to render the radar chart for two tracks
+
+        Rendering the chart is the slowest part of /visualize and the output
+        only depends on the arguments, so rendered charts are cached.
+
+        Parameters
+        ----------
+        id_a : str
+            The Spotify ID of the first track
+        id_b : str
+            The Spotify ID of the second track
+        label_a : str
+            The legend label for the first track, or id_a to use its name
+        label_b : str
+            The legend label for the second track, or id_b to use its name
+
+        Returns
+        -------
+        str
+            an html img tag with the base64 encoded png of the radar chart
+        """
+
+        track_a = track_by_spotify_id(id_a)
+        track_b = track_by_spotify_id(id_b)
 
         if label_a == id_a:
-            label_a = f"{track_df.loc[0]['track_name'][:30]}"
+            label_a = f"{track_a.track_name[:30]}"
 
         if label_b == id_b:
-            label_b = f"{track_df.loc[1]['track_name'][:30]}"
+            label_b = f"{track_b.track_name[:30]}"
 
         vis_labels = [label_a, label_b]
 
-        labels = [
-            'acousticness',
-            'danceability',
-            'energy',
-            'instrumentalness',
-            'liveness',
-            'valence'
-        ]
-
-        num_vals = len(labels)
-        angles = [n / float(num_vals) * 2 * np.pi for n in range(num_vals)]
-        angles += angles[:1]  # make cyclic to connect vertices in polygon
-
-        # Set figure settings
-        fig, ax = plt.subplots(figsize=(6, 6), subplot_kw=dict(polar=True))
-        ax.set_theta_offset(np.pi / 2)
-        ax.set_theta_direction(-1)
-        ax.set_thetagrids(np.degrees(angles), labels)
-        ax.set_rlabel_position(0)
-        ax.set_yticks([0.20, 0.40, 0.60, 0.80])
-        ax.set_yticklabels(['0.20', '0.40', '0.60', '0.80'])
-        ax.set_ylim(0, 1)
-
-        # Plot and fill the radar polygons
-        feature_df = track_df[labels]
-        colors = ['#EF019F', '#780150']
-        for i, color in enumerate(colors):
-            values = feature_df.loc[i].values.flatten().tolist()
-            values += values[:1]  # make cyclic to connect vertices in polygon
-            ax.plot(
-                angles,
-                values,
-                color=color,
-                linewidth=1,
-                linestyle='solid',
-                label=vis_labels[i]
-            )
-            ax.fill(angles, values, color=color, alpha=0.25)
-
-            # Set feature labels so they don't overlap the chart
-            for label, angle in zip(ax.get_xticklabels(), angles):
-                if angle in [0, np.pi]:
-                    label.set_horizontalalignment('center')
-                elif 0 < angle < np.pi:
-                    label.set_horizontalalignment('left')
-                else:
-                    label.set_horizontalalignment('right')
-        ax.legend(loc='best')
+        feature_values = np.array([
+            [track.acousticness,
+             track.danceability,
+             track.energy,
+             track.instrumentalness,
+             track.liveness,
+             track.valence]
+            for track in (track_a, track_b)
+        ])
+        # make cyclic to connect vertices in polygon
+        feature_values = np.hstack([feature_values, feature_values[:, :1]])
+
+        # Plot and fill the radar polygons on a pre-built figure
+        fig, ax = figure_pool.get()
+        try:
+            colors = ['#EF019F', '#780150']
+            for i, color in enumerate(colors):
+                values = feature_values[i]
+                ax.plot(
+                    RADAR_ANGLES,
+                    values,
+                    color=color,
+                    linewidth=1,
+                    linestyle='solid',
+                    label=vis_labels[i]
+                )
+                ax.fill(RADAR_ANGLES, values, color=color, alpha=0.25)
+            ax.legend(loc='best')
+
+            # Save the figure as an image to output on the app
+            pic_bytes = io.BytesIO()
+            fig.savefig(pic_bytes, format='png')
+        finally:
+            # Clear the polygons and legend before returning it to the pool
+            for artist in list(ax.lines) + list(ax.patches):
+                artist.remove()
+            if ax.get_legend() is not None:
+                ax.get_legend().remove()
+            figure_pool.put((fig, ax))
 
-        # Save the figure as an image to output on the app
-        pic_bytes = io.BytesIO()
-        plt.savefig(pic_bytes, format='png')
         pic_bytes.seek(0)
         data = base64.b64encode(pic_bytes.read()).decode('ascii')
-        plt.clf()
         return f"<img src='data:image/png;base64,{data}'>"
 
+    def get_spotify():
+        """A helper function to get the shared Spotify client
+
+        The access token is only requested again once it is within
+        TOKEN_EXPIRY_BUFFER seconds of expiring, so most requests reuse both
+        the token and the open connection to the Spotify API.
+
+        Returns
+        -------
+        Spotify object
+            the Spotify client authorized with a valid access token
+        """
+
+        nonlocal token_expiry
+        with token_lock:
+            if time.monotonic() >= token_expiry - TOKEN_EXPIRY_BUFFER:
+                spotify._auth = credentials.get_access_token()
+                expires_in = credentials.token_info['expires_in']
+                token_expiry = time.monotonic() + expires_in
+        return spotify
+
+    def call_spotify(method, *args, **kwargs):
+        """A helper function to call the Spotify API within the rate limits
+
+        Calls wait for the client-side rate limiter, and calls rejected by
+        Spotify with a 429 or a 5xx server error are retried after the
+        Retry-After delay, or an exponential backoff if the header is
+        missing. A delay longer than
+        SPOTIFY_MAX_RETRY_WAIT fails the request rather than holding the
+        worker.
+
+        Parameters
+        ----------
+        method : str
+            The name of the Spotify client method to call
+        *args, **kwargs
+            The arguments for the Spotify client method
+
+        Returns
+        -------
+        json
+            the results of the Spotify API call
+
+        Raises
+        ------
+        SpotifyException:
+            an exception if the call failed, returned no results, or was still
+            rate limited or failing after SPOTIFY_MAX_RETRIES retries
+        ServiceUnavailable:
+            a 503 error, with Spotify's Retry-After header, if Spotify asked
+            for a longer wait than SPOTIFY_MAX_RETRY_WAIT
+        """
+
+        for attempt in range(SPOTIFY_MAX_RETRIES + 1):
+            try:
+                with spotify_limiter:
+                    return getattr(get_spotify(), method)(*args, **kwargs)
+            except SpotifyException as e:
+                retryable = e.http_status == 429 or 500 <= e.http_status < 600
+                if not retryable or attempt == SPOTIFY_MAX_RETRIES:
+                    raise
+                headers = getattr(e, 'headers', None) or {}
+                retry_after = headers.get('Retry-After')
+                if retry_after is None:
+                    wait = 2 ** attempt + random.random()
+                else:
+                    wait = float(retry_after)
+                if wait > SPOTIFY_MAX_RETRY_WAIT:
+                    abort(Response(
+                        'The Spotify API is rate limited, try again later',
+                        status=503,
+                        headers={'Retry-After': str(retry_after)}
+                    ))
+                time.sleep(wait)
+
+    @lru_cache(maxsize=CACHE_SIZE)
+    def fetch_track_info(track_id):
+        """A helper function to get the track information for a track ID
+
+        Track information does not change, so results are cached per track ID
+        to avoid calling the Spotify API for repeated requests. Failed calls
+        raise rather than return, so they are never cached.
+
+        Parameters
+        ----------
+        track_id : str
+            The Spotify ID of the track
+
+        Returns
+        -------
+        json
+            a json object with the selected track information to send to the
+            back-end
+
+        Raises
+        ------
+        BadGateway:
+            a 502 error if the Spotify results could not be parsed
+        """
+
+        return parse_track_info(call_spotify('track', track_id))
+
+    @lru_cache(maxsize=CACHE_SIZE)
+    def fetch_audio_features(track_id):
+        """A helper function to get the audio features for a track ID
+
+        Audio features do not change, so results are cached per track ID to
+        avoid calling the Spotify API for repeated requests. Failed calls
+        raise rather than return, so they are never cached.
+
+        Parameters
+        ----------
+        track_id : str
+            The Spotify ID of the track
+
+        Returns
+        -------
+        json
+            a json of the audio features and track identification
+
+        Raises
+        ------
+        BadGateway:
+            a 502 error if Spotify returned no audio features, as it does for
+            unknown track IDs
+        """
+
+        results = call_spotify('audio_features', track_id)
+        if not results or results[0] is None:
+            abort(502, description='No audio features returned by Spotify')
+        return orjson.dumps(results)
+
+    @lru_cache(maxsize=CACHE_SIZE)
+    def find_suggestions(seed_track, num_tracks):
+        """A helper function to get the model suggestions for a seed track
+
+        The model and database are static, so results are cached per seed
+        track and number of suggestions.
+
+        Parameters
+        ----------
+        seed_track : str
+            The Spotify ID of the seed track
+        num_tracks : int
+            The number of suggested tracks to return
+
+        Returns
+        -------
+        json
+            a json of the information for seed track and similar track
+            suggestions
+
+        Raises
+        ------
+        NotFound:
+            a 404 error if the seed track is not in the database
+        """
+
+        # Indexed seeds use their row of the scaled feature array, while
+        # tracks added to the database since, whose IDs are past the end of
+        # the array, are scaled from their row
+        seed_row = Track.row_for(seed_track)
+        seed_id = None
+        if seed_row is not None:
+            seed_id = Track.feature_ids()[seed_row].item()
+        if seed_id is not None and seed_id < len(seed_rows):
+            seed_features = seed_rows[seed_id:seed_id + 1]
+        else:
+            query1 = track_by_spotify_id(seed_track)
+            if query1 is None:
+                abort(404)
+            seed_id = query1.id
+            seed_features = scale_features(query1)
+        results = query_neighbors(seed_features, num_tracks+1)
+        suggested_tracks = results.tolist()
+
+        # Fetch the seed and neighbors by primary key only as plain rows in
+        # one query, then drop the seed and restore the KDTree's
+        # nearest-first order in Python
+        table = Track.__table__
+        query = select([table.c.id] + result_columns)
+        rows = DB.session.execute(
+            query.where(table.c.id.in_(suggested_tracks + [seed_id]))
+        ).fetchall()
+        by_id = {row[0]: dict(zip(RESULT_FIELDS, row[1:])) for row in rows}
+        query2 = [
+            by_id[id] for id in suggested_tracks
+            if id in by_id and by_id[id]['track_id'] != seed_track
+        ]
+
+        return orjson.dumps({
+            'seed': by_id[seed_id],
+            'results': query2
+        })
+
+    def track_by_spotify_id(track_id):
+        """A helper function to get the track data for a Spotify track ID
+
+        Only tracks that are found are cached, so a track inserted after a
+        lookup missed it is found by the next lookup.
+
+        Parameters
+        ----------
+        track_id : str
+            The Spotify ID of the track
+
+        Returns
+        -------
+        TrackDTO
+            the track with the given Spotify ID, or None if it isn't in the
+            database
+        """
+
+        try:
+            return fetch_track(track_id)
+        except LookupError:
+            return None
+
+    @lru_cache(maxsize=CACHE_SIZE)
+    def fetch_track(track_id):
+        """A helper function to fetch the track data for a Spotify track ID
+
+        Track rows are never updated by the app, so lookups are cached per
+        track ID. The cached tracks are slotted TrackDTOs rather than ORM
+        Tracks, so they hold no session state and take less memory.
+
+        Parameters
+        ----------
+        track_id : str
+            The Spotify ID of the track
+
+        Returns
+        -------
+        TrackDTO
+            the track with the given Spotify ID
+
+        Raises
+        ------
+        LookupError:
+            an exception if the track isn't in the database, which is raised
+            rather than returned so the miss isn't cached
+        """
+
+        query = track_dto_query.where(Track.__table__.c.track_id == track_id)
+        row = DB.session.execute(query.limit(1)).first()
+        if row is None:
+            raise LookupError(track_id)
+        return TrackDTO(row)
+
+    def scale_features(track):
+        """A helper function to scale a track's features for the model
+
+        Applies the MinMaxScaler transform (X * scale + min) to the track's
+        cached feature vector, writing the product straight into an array
+        from the request's vector arena rather than copying the features in
+        first.
+
+        Parameters
+        ----------
+        track : TrackDTO
+            The track to get the model input for
+
+        Returns
+        -------
+        array
+            a (1, 12) float32 array of the scaled audio features of the track
+        """
+
+        features = request_arena().alloc((1, NUM_FEATURES))
+        np.multiply(track.to_array(), scaler_scale, out=features[0])
+        np.add(features, scaler_min, out=features)
+        return features
+
+    def request_arena():
+        """A helper function to get the vector arena of the current thread
+
+        Returns
+        -------
+        VectorArena
+            the arena, created on the thread's first request
+        """
+
+        arena = getattr(query_local, 'arena', None)
+        if arena is None:
+            arena = query_local.arena = VectorArena(ARENA_SIZE)
+        return arena
+
+    def as_float32(features):
+        """A helper function to get features as a float32 array
+
+        Parameters
+        ----------
+        features : array
+            An array of scaled audio features
+
+        Returns
+        -------
+        array
+            the features, copied into the request's vector arena if they
+            aren't float32 already
+        """
+
+        if features.dtype == np.float32:
+            return features
+        out = request_arena().alloc(features.shape)
+        out[...] = features
+        return out
+
+    def query_neighbors(features, k):
+        """A helper function to find the nearest tracks to scaled features
+
+        Parameters
+        ----------
+        features : array
+            A (1, 12) array of scaled audio features
+        k : int
+            The number of neighbors to return
+
+        Returns
+        -------
+        array
+            the database IDs of the nearest tracks, nearest first
+        """
+
+        if hnsw_index is not None:
+            _, results = hnsw_index.search(as_float32(features), k)
+            return results[0][results[0] >= 0]
+        if brute_features is not None:
+            if brute_quantizer is not None:
+                query = quantize_query(features[0], *brute_quantizer)
+            else:
+                query = as_float32(features)[0]
+            return knn_topk(brute_features, query, k)
+        _, results = model.query(features, k=k)
+        return results[0]
+
     def get_search_info(results):
         """A helper function to output specific track information from search results
 
         Parameters
         ----------
-        results : json
-            The results from a Spotify search for a track title
+        results : list
+            The results from Spotify searches for one or more track titles,
+            which are merged in order
 
         Returns
         -------
@@ -334,22 +1393,23 @@ def create_app():
 
         Raises
         ------
-        Exception:
-            an exception if there was an error retrieving the data
+        BadGateway:
+            a 502 error if there was an error parsing the results
         """
 
         try:
             output = []
-            for item in results['tracks']['items']:
-                info_dict = dict()
-                info_dict['artist_name'] = item['artists'][0]['name']
-                info_dict['track_name'] = item['name']
-                info_dict['track_id'] = item['id']
-                info_dict['cover_art'] = item['album']['images'][1]['url']
-                output.append(info_dict)
-            return json.dumps(output)
+            for page_results in results:
+                for item in page_results['tracks']['items']:
+                    info_dict = dict()
+                    info_dict['artist_name'] = item['artists'][0]['name']
+                    info_dict['track_name'] = item['name']
+                    info_dict['track_id'] = item['id']
+                    info_dict['cover_art'] = item['album']['images'][1]['url']
+                    output.append(info_dict)
+            return orjson.dumps(output)
         except Exception as e:
-            return f'Error while parsing the results: {e}'
+            abort(502, description=f'Error while parsing the results: {e}')
 
     def parse_track_info(results):
         """A helper function to output specific track information
@@ -367,8 +1427,8 @@ def create_app():
 
         Raises
         ------
-        Exception:
-            an exception if there was an error retrieving the data
+        BadGateway:
+            a 502 error if there was an error parsing the results
         """
 
         try:
@@ -379,119 +1439,17 @@ def create_app():
             info_dict['track_id'] = results['id']
             info_dict['cover_art'] = results['album']['images'][1]['url']
             output.append(info_dict)
-            return json.dumps(output)
+            return orjson.dumps(output)
         except Exception as e:
-            return f'Error while parsing the results: {e}'
-
-    class Track(DB.Model):
-        """A class used to represent a Spotify track
-
-        Attributes
-        ----------
-        __table__ : table
-            a reference to the table stored in the AWS database instance
-
-        Methods
-        -------
-        to_array()
-            Convert the data used as input for the KDTree model to an array
-
-        to_dict()
-            Convert track data and audio features to a dictionary for easy
-            JSON output
-
-        result_dict()
-            Generate the basic track data the front-end needs to display
-
-        __repr__()
-            Display the basic track data in JSON format
-
-        """
-        __table__ = DB.Model.metadata.tables['track']
-
-        def to_array(self):
-            """Converts audio features used in the model to a NumPy array
-
-            Returns
-            -------
-            array
-                an array of the audio features used in the model
-            """
-
-            return np.array([self.acousticness,
-                            self.danceability,
-                            self.energy,
-                            self.instrumentalness,
-                            self.key,
-                            self.liveness,
-                            self.loudness,
-                            self.mode,
-                            self.speechiness,
-                            self.tempo,
-                            self.time_signature,
-                            self.valence])
-
-        def to_dict(self):
-            """Converts the information in the database to a dictionary
-
-            This dictionary is mostly used for printing and display purposes,
-            as well as getting a nice format to change the data back into a
-            DataFrame.
-
-            Returns
-            -------
-            dict
-                a dict of the track features in the database
-            """
-
-            return {
-                'track_id': self.track_id,
-                'track_name': self.track_name,
-                'artist_name': self.artist_name,
-                'acousticness': self.acousticness,
-                'danceability': self.danceability,
-                'energy': self.energy,
-                'instrumentalness': self.instrumentalness,
-                'key': self.key,
-                'liveness': self.liveness,
-                'loudness': self.loudness,
-                'mode': self.mode,
-                'speechiness': self.speechiness,
-                'tempo': self.tempo,
-                'time_signature': self.time_signature,
-                'valence': self.valence
-            }
-
-        def result_dict(self):
-            """Converts track display information to a dict
-
-            This dictionary is used for display purposes and for sending only
-            the relevant track information to the back-end.
-
-            Returns
-            -------
-            dict
-                a dict with the relevant track display information
-            """
-
-            return {
-                'track_id': self.track_id,
-                'track_name': self.track_name,
-                'artist_name': self.artist_name
-            }
-
-        def __repr__(self):
-            """The default representation of a Track
-
-            This is a JSON representation of the relevant track information.
+            abort(502, description=f'Error while parsing the results: {e}')
 
-            Returns
-            -------
-            json
-                a json of the relevant track information to send to the
-                back-end
-            """
+    # Columns for /match-feature, so feature names never reach the query text
+    feature_columns = {
+        name: Track.__table__.c[name] for name in MATCH_FEATURES
+    }
 
-            return json.dumps(self.result_dict())
+    # Columns selected for result lists, skipping ORM Track instances
+    result_columns = [Track.__table__.c[name] for name in RESULT_FIELDS]
+    track_dto_query = TrackDTO.select()
 
     return app
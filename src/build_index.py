@@ -0,0 +1,25 @@
+"""Build the faiss HNSW neighbor indexes for Spotify Song Suggester.
+
+Run from the repository root after rm_05.npy changes, then deploy the index
+files with it:
+
+    python src/build_index.py
+"""
+from app import build_hnsw_index, HNSW_INDEX_PATHS, load_features
+import faiss
+
+
+def main():
+    """Build each HNSW index from the scaled features and write it to disk"""
+
+    features = load_features('./rm_05.npy')
+    for neighbor_index, path in HNSW_INDEX_PATHS.items():
+        index = build_hnsw_index(
+            features, quantize=neighbor_index == 'hnsw-sq8'
+        )
+        faiss.write_index(index, path)
+        print(f'Wrote {path} ({index.ntotal} tracks)')
+
+
+if __name__ == '__main__':
+    main()
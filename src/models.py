@@ -0,0 +1,473 @@
+"""Database models for Spotify Song Suggester."""
+from flask_sqlalchemy import SQLAlchemy
+import numpy as np
+from operator import attrgetter
+import orjson
+from sqlalchemy import select
+from sqlalchemy.orm import load_only
+from sqlalchemy.ext.declarative import DeferredReflection
+import sys
+
+# Audio features used as input for the KDTree model, in model column order
+FEATURE_ATTRS = (
+    'acousticness',
+    'danceability',
+    'energy',
+    'instrumentalness',
+    'key',
+    'liveness',
+    'loudness',
+    'mode',
+    'speechiness',
+    'tempo',
+    'time_signature',
+    'valence'
+)
+NUM_FEATURES = len(FEATURE_ATTRS)
+
+# Track columns sent to the back-end for each track in a result list. The
+# result and to_dict() keys are interned, so every dict built from them
+# shares the same key objects.
+RESULT_FIELDS = tuple(map(sys.intern, (
+    'track_id',
+    'track_name',
+    'artist_name'
+)))
+
+# Track columns in to_dict() order
+TRACK_FIELDS = RESULT_FIELDS + tuple(map(sys.intern, FEATURE_ATTRS))
+
+# Getters reading each group of columns from a track in one call
+_FEATURE_GETTER = attrgetter(*FEATURE_ATTRS)
+_RESULT_GETTER = attrgetter(*RESULT_FIELDS)
+_TRACK_GETTER = attrgetter(*TRACK_FIELDS)
+
+# In-process cache of the model features of every track, in database ID
+# order, with the database IDs of its rows and the row of each Spotify
+# track ID. Loaded by Track.load_feature_cache(). The features are kept
+# transposed, so each feature column is contiguous for filter scans, and as
+# float64 like the database, so filters match the same rows as SQL. The
+# neighbor indexes use the scaled features in rm_05.npy instead.
+_FEATURE_COLUMNS = None
+_FEATURE_IDS = None
+_ROW_INDEX = None
+
+# The app only reads from the database, so queries never need to flush
+DB = SQLAlchemy(session_options={'autoflush': False})
+
+
+class Track(DeferredReflection, DB.Model):
+    """A class used to represent a Spotify track
+
+    Attributes
+    ----------
+    __tablename__ : str
+        the name of the table stored in the AWS database instance, which is
+        reflected by prepare() once the database engine is available
+
+    Methods
+    -------
+    to_array()
+        Convert the data used as input for the KDTree model to an array
+
+    to_array_into()
+        Write the data used as input for the KDTree model into a row of a
+        feature matrix
+
+    stack_features()
+        Convert the model input data of many tracks to one feature matrix
+
+    query_for_features()
+        Build a query for tracks that only loads the model input data
+
+    load_feature_cache()
+        Load the model input data of every track into the in-process cache
+
+    clear_feature_cache()
+        Empty the in-process cache of model input data
+
+    feature_column()
+        Get the cached values of one model input feature for every track
+
+    feature_ids()
+        Get the database IDs of the rows of the cached features
+
+    row_for()
+        Get the row of the cached features for a Spotify track ID
+
+    to_dict()
+        Convert track data and audio features to a dictionary for easy
+        JSON output
+
+    result_values()
+        Get the basic track data the front-end needs to display, in
+        RESULT_FIELDS order
+
+    result_dict()
+        Generate the basic track data the front-end needs to display
+
+    __repr__()
+        Display the basic track data in JSON format
+
+    """
+    __tablename__ = 'track'
+
+    # Declared so the mapper has a primary key however the table was created
+    id = DB.Column(DB.BigInteger, primary_key=True)
+
+    def to_array(self, out=None):
+        """Converts audio features used in the model to a NumPy array
+
+        The features are read with one attrgetter call and written straight
+        into the array. Track rows are never updated by the app, so
+        without out the array is built once and kept on the instance.
+
+        Parameters
+        ----------
+        out : array, optional
+            a preallocated array of length 12 to write the features into
+            instead of returning the cached float32 array
+
+        Returns
+        -------
+        array
+            an array of the audio features used in the model, read-only if
+            out isn't given
+        """
+
+        if out is None:
+            cached = getattr(self, '_features', None)
+            if cached is not None:
+                return cached
+            cached = self.to_array(out=np.empty(NUM_FEATURES, np.float32))
+            cached.flags.writeable = False
+            self._features = cached
+            return cached
+        out[:] = _FEATURE_GETTER(self)
+        return out
+
+    def to_array_into(self, out, offset):
+        """Writes audio features used in the model into a feature matrix
+
+        Parameters
+        ----------
+        out : array
+            an (N, 12) feature matrix
+        offset : int
+            the row of the matrix to write the features into
+
+        Returns
+        -------
+        array
+            the row of the matrix holding the audio features of the track
+        """
+
+        return self.to_array(out=out[offset])
+
+    @classmethod
+    def stack_features(cls, tracks):
+        """Converts audio features of many tracks to one feature matrix
+
+        The matrix is allocated once and filled a feature column at a time,
+        so it can be passed straight to the model or a distance function
+        instead of stacking one array per track.
+
+        Parameters
+        ----------
+        tracks : list
+            the tracks to get the audio features of
+
+        Returns
+        -------
+        array
+            an (N, 12) float32 array of the audio features used in the model,
+            with one row per track
+        """
+
+        out = np.empty((len(tracks), NUM_FEATURES), dtype=np.float32)
+        for j, attr in enumerate(FEATURE_ATTRS):
+            out[:, j] = np.fromiter(
+                (getattr(track, attr) for track in tracks),
+                dtype=np.float32,
+                count=len(tracks)
+            )
+        return out
+
+    @classmethod
+    def query_for_features(cls):
+        """Builds a query for tracks that only loads their audio features
+
+        The display columns are deferred, so tracks from this query can be
+        passed to to_array() or stack_features() without loading any track
+        or artist name strings. Reading a deferred column later loads it
+        with another query.
+
+        Returns
+        -------
+        Query
+            a query of tracks with only the ID, Spotify ID, and audio
+            features loaded
+        """
+
+        return DB.session.query(cls).options(
+            load_only('id', 'track_id', *FEATURE_ATTRS)
+        )
+
+    @classmethod
+    def load_feature_cache(cls, connection):
+        """Loads the audio features of every track into the in-process cache
+
+        The database IDs, Spotify IDs, and feature columns are fetched with
+        fetch_feature_matrix(), so no Track instances are created for the
+        rows.
+
+        Parameters
+        ----------
+        connection : Connection or Session
+            the database connection to run the query on
+        """
+
+        global _FEATURE_COLUMNS, _FEATURE_IDS, _ROW_INDEX
+
+        _FEATURE_IDS, track_ids, matrix = fetch_feature_matrix(
+            connection, dtype=np.float64
+        )
+        _ROW_INDEX = {track_id: i for i, track_id in enumerate(track_ids)}
+        _FEATURE_COLUMNS = np.ascontiguousarray(matrix.T)
+
+    @classmethod
+    def clear_feature_cache(cls):
+        """Empties the in-process cache of audio features
+
+        Call this after writing to the track table so stale features are not
+        served, then reload the cache with load_feature_cache().
+        """
+
+        global _FEATURE_COLUMNS, _FEATURE_IDS, _ROW_INDEX
+
+        _FEATURE_COLUMNS = None
+        _FEATURE_IDS = None
+        _ROW_INDEX = None
+
+    @classmethod
+    def feature_column(cls, name):
+        """Gets the cached values of one audio feature for every track
+
+        Parameters
+        ----------
+        name : str
+            The name of one of the audio features used in the model
+
+        Returns
+        -------
+        array
+            a contiguous (N,) float64 array of the feature, with one value
+            per track in database ID order, or None if the cache isn't
+            loaded
+
+        Raises
+        ------
+        ValueError:
+            an exception if name isn't one of the model features
+        """
+
+        index = FEATURE_ATTRS.index(name)
+        if _FEATURE_COLUMNS is None:
+            return None
+        return _FEATURE_COLUMNS[index]
+
+    @classmethod
+    def feature_ids(cls):
+        """Gets the database IDs of the rows of the cached features
+
+        Returns
+        -------
+        array
+            an array of the database ID of each row of the cached features
+        """
+
+        return _FEATURE_IDS
+
+    @classmethod
+    def row_for(cls, track_id):
+        """Gets the row of the cached features for a track
+
+        Parameters
+        ----------
+        track_id : str
+            the Spotify ID of the track
+
+        Returns
+        -------
+        int
+            the row of the cached features, or None if the track isn't cached
+        """
+
+        if _ROW_INDEX is None:
+            return None
+        return _ROW_INDEX.get(track_id)
+
+    def to_dict(self):
+        """Converts the information in the database to a dictionary
+
+        This dictionary is mostly used for printing and display purposes,
+        as well as getting a nice format to change the data back into a
+        DataFrame.
+
+        Returns
+        -------
+        dict
+            a dict of the track features in the database
+        """
+
+        return dict(zip(TRACK_FIELDS, _TRACK_GETTER(self)))
+
+    def result_values(self):
+        """Gets the track display information as a tuple
+
+        The values are in RESULT_FIELDS order, the same as the rows of a Core
+        select of the result columns, so callers that only serialize them
+        can skip building a dict.
+
+        Returns
+        -------
+        tuple
+            the relevant track display information
+        """
+
+        return _RESULT_GETTER(self)
+
+    def result_dict(self):
+        """Converts track display information to a dict
+
+        This dictionary is used for display purposes and for sending only
+        the relevant track information to the back-end.
+
+        Returns
+        -------
+        dict
+            a dict with the relevant track display information
+        """
+
+        return dict(zip(RESULT_FIELDS, self.result_values()))
+
+    def __repr__(self):
+        """The default representation of a Track
+
+        This is a JSON representation of the relevant track information.
+        Track rows are never updated by the app, so it is encoded once and
+        kept on the instance.
+
+        Returns
+        -------
+        json
+            a json of the relevant track information to send to the
+            back-end
+        """
+
+        encoded = self.__dict__.get('_json')
+        if encoded is None:
+            encoded = orjson.dumps(self.result_dict()).decode()
+            self.__dict__['_json'] = encoded
+        return encoded
+
+
+class TrackDTO:
+    """A lightweight read-only copy of a track row
+
+    Holds the same data as a Track in slots, without the ORM instance state
+    and per-instance dict, for tracks kept in memory between requests. It is
+    built from the rows of a Core select, so it never belongs to a session.
+
+    Attributes
+    ----------
+    COLUMNS : tuple
+        the database ID, display fields, and audio features of the track, in
+        the order they are selected
+    __slots__ : tuple
+        the columns, and the cached array of audio features
+
+    Methods
+    -------
+    select()
+        Build a Core select of the columns a TrackDTO is built from
+
+    to_array()
+        Convert the data used as input for the KDTree model to an array
+
+    to_array_into()
+        Write the data used as input for the KDTree model into a row of a
+        feature matrix
+
+    to_dict()
+        Convert track data and audio features to a dictionary for easy
+        JSON output
+
+    result_values()
+        Get the basic track data the front-end needs to display, in
+        RESULT_FIELDS order
+
+    result_dict()
+        Generate the basic track data the front-end needs to display
+
+    """
+    COLUMNS = ('id',) + RESULT_FIELDS + FEATURE_ATTRS
+    __slots__ = COLUMNS + ('_features',)
+
+    def __init__(self, row):
+        for name, value in zip(self.COLUMNS, row):
+            setattr(self, name, value)
+
+    @classmethod
+    def select(cls):
+        """Builds a Core select of the track columns in COLUMNS order
+
+        Returns
+        -------
+        Select
+            a select of the columns to pass each result row of to TrackDTO
+        """
+
+        return select([Track.__table__.c[name] for name in cls.COLUMNS])
+
+    to_array = Track.to_array
+    to_array_into = Track.to_array_into
+    to_dict = Track.to_dict
+    result_values = Track.result_values
+    result_dict = Track.result_dict
+
+
+def fetch_feature_matrix(connection, dtype=np.float32):
+    """Fetch the audio features of every track as one feature matrix
+
+    The IDs and feature columns are selected with a Core query and read
+    straight into NumPy, so no Track instances are created for the rows.
+
+    Parameters
+    ----------
+    connection : Connection or Session
+        the database connection to run the query on
+    dtype : dtype, optional
+        the dtype of the feature matrix, float32 by default
+
+    Returns
+    -------
+    tuple
+        the database ID of each track as an int64 array, the Spotify ID of
+        each track as a list, and an (N, 12) array of the audio features
+        used in the model, all in database ID order
+    """
+
+    table = Track.__table__
+    columns = [table.c.id, table.c.track_id]
+    columns += [table.c[attr] for attr in FEATURE_ATTRS]
+    rows = connection.execute(
+        select(columns).order_by(table.c.id)
+    ).fetchall()
+
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    track_ids = [row[1] for row in rows]
+    matrix = np.array(
+        [row[2:] for row in rows], dtype=dtype
+    ).reshape(-1, NUM_FEATURES)
+    return ids, track_ids, matrix